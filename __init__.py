@@ -20,9 +20,9 @@ bl_info = {
     "name": "Import DirectX X Format (.x)",
     "author": "T.Yonemori, B.Okada",
     "version": (0, 5, 1),
-    "blender": (2, 66, 0),
-    "location": "File > Import > DirectX (.x)",
-    "description": "Import files in the DirectX X format (.x)",
+    "blender": (2, 70, 0),
+    "location": "File > Import-Export > DirectX (.x)",
+    "description": "Import and export files in the DirectX X format (.x)",
     "warning": "",
     "wiki_url": "",
     "tracker_url": "",
@@ -35,7 +35,21 @@ bl_info = {
 # Version 0.3 - Mar 16, 2012
 #
 import os
+import io
+import sys
+import re
+import time
+import socket
+import stat
+import traceback
+import json
+import hashlib
+import mmap
+import locale
+import itertools
+import numpy
 import bpy
+import bmesh
 from mathutils import *
 
 #
@@ -61,28 +75,87 @@ TK_UUID      = 10
 
 TK_EOF = -1
 
+#
+#    D3DDECLTYPE: (component format, component count, scale)
+#
+DECLTYPE_FORMATS = {
+    0:  ("<f4", 1, None),            # FLOAT1
+    1:  ("<f4", 2, None),            # FLOAT2
+    2:  ("<f4", 3, None),            # FLOAT3
+    3:  ("<f4", 4, None),            # FLOAT4
+    4:  ("u1",  4, 1.0 / 255.0),     # D3DCOLOR, stored as B,G,R,A
+    5:  ("u1",  4, None),            # UBYTE4
+    6:  ("<i2", 2, None),            # SHORT2
+    7:  ("<i2", 4, None),            # SHORT4
+    8:  ("u1",  4, 1.0 / 255.0),     # UBYTE4N
+    9:  ("<i2", 2, 1.0 / 32767.0),   # SHORT2N
+    10: ("<i2", 4, 1.0 / 32767.0),   # SHORT4N
+    11: ("<u2", 2, 1.0 / 65535.0),   # USHORT2N
+    12: ("<u2", 4, 1.0 / 65535.0),   # USHORT4N
+    13: ("<u4", 1, None),            # UDEC3
+    14: ("<u4", 1, 1.0 / 511.0),     # DEC3N
+    15: ("<f2", 2, None),            # FLOAT16_2
+    16: ("<f2", 4, None),            # FLOAT16_4
+    }
+
+DECLTYPE_FLOAT1   = 0
+DECLTYPE_FLOAT2   = 1
+DECLTYPE_FLOAT3   = 2
+DECLTYPE_FLOAT4   = 3
+DECLTYPE_D3DCOLOR = 4
+DECLTYPE_UDEC3    = 13
+DECLTYPE_DEC3N    = 14
+
+DECLUSAGE_POSITION    = 0
+DECLUSAGE_BLENDWEIGHT = 1
+DECLUSAGE_NORMAL      = 3
+DECLUSAGE_PSIZE       = 4
+DECLUSAGE_TEXCOORD    = 5
+DECLUSAGE_TANGENT     = 6
+DECLUSAGE_BINORMAL    = 7
+DECLUSAGE_COLOR       = 10
+
 from bpy.props import *
 
 class ImportSettings:
-    def __init__(self, CoordinateSystem=1,UpwardAxis=1):
+    def __init__(self, CoordinateSystem=1,UpwardAxis=1,SplitNormals=False,TrackChanges=False):
         self.CoordinateSystem = int(CoordinateSystem)
         self.UpwardAxis = int(UpwardAxis)
+        self.SplitNormals = bool(SplitNormals)
+        self.TrackChanges = bool(TrackChanges)
 
 class CharacterStream:
-    def __init__(self, fileName):
-        self.fp = open(fileName, "r")
+    def __init__(self, fileName, start=None, end=None):
+        # start/end restrict the stream to a byte range of the file
+        if start is None:
+            self.fp = open(fileName, "r")
+            self.remaining = None
+        else:
+            self.fp = open(fileName, "rb")
+            self.fp.seek(start)
+            self.remaining = end - start
+            self.encoding = locale.getpreferredencoding(False)
         self.curLine = ""
         self.curIndex = 0
         self.curLineLen = 0
         self.unget = ""
 
+    def readLine(self):
+        if self.remaining is None:
+            return self.fp.readline()
+        if self.remaining <= 0:
+            return ""
+        line = self.fp.readline(self.remaining)
+        self.remaining -= len(line)
+        return line.decode(self.encoding)
+
     def getChar(self):
         if self.unget != "":
             ch = self.unget
             self.unget = ""
             return ch
         elif self.curIndex >= self.curLineLen:
-            self.curLine = self.fp.readline()
+            self.curLine = self.readLine()
             self.curLineLen = len(self.curLine)
             self.curIndex = 0
             if self.curLine == "":
@@ -94,6 +167,28 @@ class CharacterStream:
     def ungetChar(self,ch):
         self.unget = ch
 
+    def readUntil(self, terminator):
+        # raw text up to terminator, which is consumed; used for long numeric arrays
+        pieces = []
+        if self.unget:
+            if self.unget == terminator:
+                self.unget = ""
+                return ""
+            pieces.append(self.unget)
+            self.unget = ""
+        while 1:
+            pos = self.curLine.find(terminator, self.curIndex)
+            if pos >= 0:
+                pieces.append(self.curLine[self.curIndex:pos])
+                self.curIndex = pos + 1
+                return "".join(pieces)
+            pieces.append(self.curLine[self.curIndex:])
+            self.curLine = self.readLine()
+            self.curLineLen = len(self.curLine)
+            self.curIndex = 0
+            if self.curLine == "":
+                return "".join(pieces)
+
     def close(self):
         self.fp.close()
 
@@ -103,14 +198,19 @@ class Token:
         self.value = value
 
 class Tokenizer:
-    def __init__(self, filePath):
+    def __init__(self, filePath, start=None, end=None):
         self.lineno = 1
         self.filePath = filePath
-        self.cstr = CharacterStream(filePath)
+        self.cstr = CharacterStream(filePath, start, end)
 
     def shutdown(self):
         self.cstr.close()
 
+    def readRawUntil(self, terminator):
+        text = self.cstr.readUntil(terminator)
+        self.lineno += text.count("\n")
+        return text
+
     def skipToEOL(self):
         while 1:
             c = self.cstr.getChar()
@@ -211,14 +311,375 @@ class MeshData:
         self.faceMaterialIndex = None
         self.normals = None
         self.faceNormals = None
+        self.declData = None
+
+#
+#    Block index
+#
+BLOCK_INDEX_VERSION = 2
+
+# Only braces, identifiers and anything that may hide a brace (comments, strings,
+# UUIDs) are matched, so the numeric payload of meshes is skipped inside the regex engine.
+blockTokenPattern     = re.compile(rb'//[^\n]*|#[^\n]*|"[^"]*"|<[^>]*>|[{}]|(?<![\w.\-])[A-Za-z_][\w\-]*')
+blockCountPattern     = re.compile(rb'\s*(\d+)\s*;')
+blockFaceCountPattern = re.compile(rb';\s*;\s*(\d+)\s*;')
+
+class BlockInfo:
+    # Only the last path segment is stored; full paths are built on demand with
+    # blockPath so the index stays linear in the number of blocks.
+    def __init__(self, kind, name=None, segment="", parent=-1, depth=0, offset=0, size=0,
+                 vertices=0, faces=0, materials=None, matrixOffset=-1, matrixSize=0):
+        self.kind      = kind
+        self.name      = name
+        self.segment   = segment
+        self.parent    = parent
+        self.depth     = depth
+        self.offset    = offset
+        self.size      = size
+        self.vertices  = vertices
+        self.faces     = faces
+        self.materials = materials if materials is not None else []
+        self.matrixOffset = matrixOffset
+        self.matrixSize   = matrixSize
+
+def scanBlockIndex(filePath):
+    blocks = []
+    if os.path.getsize(filePath) == 0:
+        return blocks
+    with open(filePath, "rb") as fp:
+        buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            # stack items: [block index or -1, opened without a template name,
+            #               FrameTransformMatrix owner or -1]
+            stack = [[-1, False, -1]]
+            siblings = {}
+            pending = []
+            for m in blockTokenPattern.finditer(buf):
+                tok = m.group()
+                if tok == b"{":
+                    kind = name = None
+                    if pending and buf[pending[-1].end():m.start()].strip() == b"":
+                        last = pending[-1]
+                        if len(pending) >= 2 and buf[pending[-2].end():last.start()].strip() == b"":
+                            kind = pending[-2].group().decode("ascii")
+                            name = last.group().decode("ascii")
+                            start = pending[-2].start()
+                        else:
+                            kind = last.group().decode("ascii")
+                            start = last.start()
+                    pending = []
+                    # index exactly what the parser turns into objects: top-level
+                    # Frames, Meshes and Materials and the Frames and Meshes directly
+                    # inside an indexed Frame
+                    parentIndex = stack[-1][0]
+                    inFrame = parentIndex >= 0 and blocks[parentIndex].kind == "Frame"
+                    topLevel = len(stack) == 1
+                    if (kind in ("Frame", "Mesh") and (topLevel or inFrame)) or (kind == "Material" and topLevel):
+                        # segments are unique among siblings: repeated names and
+                        # unnamed blocks get a "#ordinal" suffix
+                        counters = siblings.setdefault(parentIndex, {})
+                        base = name if name is not None else kind
+                        ordinal = counters.get(base, 0)
+                        counters[base] = ordinal + 1
+                        if name is not None and ordinal == 0:
+                            segment = name
+                        else:
+                            segment = base + "#" + str(ordinal)
+                        block = BlockInfo(kind, name, segment, parentIndex, 0, start)
+                        if parentIndex >= 0:
+                            block.depth = blocks[parentIndex].depth + 1
+                        if kind == "Mesh":
+                            c = blockCountPattern.match(buf, m.end())
+                            if c:
+                                block.vertices = int(c.group(1))
+                                c = blockFaceCountPattern.search(buf, c.end())
+                                if c:
+                                    block.faces = int(c.group(1))
+                        blocks.append(block)
+                        stack.append([len(blocks) - 1, False, -1])
+                    elif kind == "FrameTransformMatrix" and inFrame:
+                        blocks[parentIndex].matrixOffset = start
+                        stack.append([-1, False, parentIndex])
+                    else:
+                        stack.append([-1, kind is None, -1])
+                elif tok == b"}":
+                    if len(stack) < 2:
+                        raise RuntimeError("unbalanced brace at " + str(m.start()))
+                    blockIndex, anonymous, matrixOwner = stack.pop()
+                    if blockIndex >= 0:
+                        blocks[blockIndex].size = m.end() - blocks[blockIndex].offset
+                    elif matrixOwner >= 0:
+                        blocks[matrixOwner].matrixSize = m.end() - blocks[matrixOwner].matrixOffset
+                    elif anonymous and len(pending) == 1:
+                        # { MaterialName } reference; credit the innermost indexed block
+                        for item in reversed(stack):
+                            if item[0] >= 0:
+                                blocks[item[0]].materials.append(pending[0].group().decode("ascii"))
+                                break
+                    pending = []
+                elif tok[0] in b'/#"<':
+                    pass
+                else:
+                    pending.append(m)
+        finally:
+            buf.close()
+    return blocks
+
+def blockIndexPath(filePath):
+    return filePath + ".xidx"
+
+def loadBlockIndex(filePath):
+    st = os.stat(filePath)
+    key = {"version": BLOCK_INDEX_VERSION, "size": st.st_size, "mtime": st.st_mtime}
+    try:
+        with open(blockIndexPath(filePath), "r") as fp:
+            data = json.load(fp)
+        if data.get("key") == key:
+            return [BlockInfo(**b) for b in data["blocks"]]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    blocks = scanBlockIndex(filePath)
+    try:
+        with open(blockIndexPath(filePath), "w") as fp:
+            json.dump({"key": key, "blocks": [vars(b) for b in blocks]}, fp)
+    except OSError:
+        print("Cannot write block index: " + blockIndexPath(filePath))
+    return blocks
+
+def blockPath(blocks, index):
+    segments = []
+    while index >= 0:
+        segments.append(blocks[index].segment)
+        index = blocks[index].parent
+    return "/".join(reversed(segments))
+
+def blockKeys(blocks):
+    """Fixed-size identity of every block path, built from the parent's key so
+    the cost stays linear however deep the hierarchy is."""
+    keys = []
+    for b in blocks:
+        parentKey = keys[b.parent] if b.parent >= 0 else ""
+        keys.append(hashlib.sha1((parentKey + "/" + b.segment).encode("utf-8")).hexdigest())
+    return keys
+
+def findBlocks(blocks, paths):
+    """Indexes of the Frames and Meshes at the given "/"-separated paths."""
+    children = {}
+    for i, b in enumerate(blocks):
+        if b.kind != "Material":
+            children[(b.parent, b.segment)] = i
+    result = []
+    for path in paths:
+        index = -1
+        for segment in path.split("/"):
+            index = children.get((index, segment), -2)
+            if index < 0:
+                raise RuntimeError("no such block: " + path)
+        result.append(index)
+    return result
+
+def selectBlocks(blocks, indices):
+    """Resolve the chosen block indexes to the byte ranges to parse: the top-level
+    Materials referenced anywhere in the selection followed by the outermost
+    selected blocks."""
+    chosen = set(indices)
+    covered = [False] * len(blocks)
+    selected = []
+    refs = set()
+    # blocks are in pre-order, so a parent's flag is known before its children
+    for i, b in enumerate(blocks):
+        if b.kind == "Material":
+            continue
+        inherited = b.parent >= 0 and covered[b.parent]
+        if i in chosen and not inherited:
+            selected.append(b)
+        covered[i] = inherited or i in chosen
+        if covered[i]:
+            refs.update(b.materials)
+    materials = [b for b in blocks if b.kind == "Material" and b.parent < 0 and b.name in refs]
+    return materials + selected
+
+def blockHashes(filePath, blocks, salt=""):
+    """Content hash of every block. A Mesh hashes its bytes plus the hashes of the
+    Materials it references. A Frame hashes only its own bytes, with nested Frames
+    and Meshes cut out, so a transform edit does not invalidate the mesh and an
+    edit deep in the hierarchy does not invalidate its ancestors."""
+    hashes = [None] * len(blocks)
+    nested = [[] for b in blocks]
+    for b in blocks:
+        if b.kind != "Material" and b.parent >= 0:
+            nested[b.parent].append(b)
+    with open(filePath, "rb") as fp:
+        buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            materialHashes = {}
+            for i, b in enumerate(blocks):
+                if b.kind == "Material":
+                    hashes[i] = hashlib.sha1(buf[b.offset:b.offset + b.size]).hexdigest()
+                    materialHashes[b.name] = hashes[i]
+            for i, b in enumerate(blocks):
+                if b.kind == "Material":
+                    continue
+                h = hashlib.sha1(salt.encode("ascii"))
+                pos = b.offset
+                for c in nested[i]:
+                    h.update(buf[pos:c.offset])
+                    pos = c.offset + c.size
+                h.update(buf[pos:b.offset + b.size])
+                for name in sorted(set(b.materials)):
+                    h.update(materialHashes.get(name, "").encode("ascii"))
+                hashes[i] = h.hexdigest()
+        finally:
+            buf.close()
+    return hashes
+
+def hashSalt(config):
+    # settings that change the imported result are part of every content hash
+    return "%d %d %d" % (config.CoordinateSystem, config.UpwardAxis, config.SplitNormals)
+
+def objectBlocks(blocks):
+    """(block, mesh block or -1) for every block that becomes an object: Frames,
+    with the last Mesh directly inside them, and top-level Meshes. The order is
+    the order in which the parser creates the objects."""
+    meshOf = {}
+    for i, b in enumerate(blocks):
+        if b.kind == "Mesh" and b.parent >= 0:
+            meshOf[b.parent] = i
+    items = []
+    for i, b in enumerate(blocks):
+        if b.kind == "Frame":
+            items.append((i, meshOf.get(i, -1)))
+        elif b.kind == "Mesh" and b.parent < 0:
+            items.append((i, i))
+    return items
+
+class ImportCache:
+    """Images and block indexes shared between imports of a long-running process."""
+
+    def __init__(self):
+        self.images = {}
+        self.blockIndexes = {}
+
+    def loadImage(self, absPath):
+        name = self.images.get(absPath)
+        if name is not None and name in bpy.data.images:
+            return bpy.data.images[name]
+        image = bpy.data.images.load(absPath)
+        image.use_fake_user = True
+        self.images[absPath] = image.name
+        return image
+
+    def loadBlockIndex(self, filePath):
+        st = os.stat(filePath)
+        key = (st.st_size, st.st_mtime)
+        cached = self.blockIndexes.get(filePath)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        blocks = loadBlockIndex(filePath)
+        self.blockIndexes[filePath] = (key, blocks)
+        return blocks
+
+    def clear(self):
+        for name in self.images.values():
+            if name in bpy.data.images:
+                bpy.data.images[name].use_fake_user = False
+        self.images = {}
+        self.blockIndexes = {}
+
+def readBlockIndex(filePath, cache=None):
+    if cache is None:
+        return loadBlockIndex(filePath)
+    return cache.loadBlockIndex(filePath)
+
+def xFileName(filepath):
+    # expanded path of an existing .x file, or None
+    fileName = os.path.expanduser(filepath)
+    (shortName, ext) = os.path.splitext(fileName)
+    if not fileName or ext.lower() != ".x" or not os.path.isfile(fileName):
+        return None
+    return fileName
+
+def fvfElements(fvf):
+    """Translate a D3DFVF code into (type, usage, usageIndex) vertex elements."""
+    elements = []
+    position = fvf & 0x400E
+    if position == 0x002:
+        elements.append((DECLTYPE_FLOAT3, DECLUSAGE_POSITION, 0))
+    elif position in (0x004, 0x4002):
+        elements.append((DECLTYPE_FLOAT4, DECLUSAGE_POSITION, 0))
+    elif position in (0x006, 0x008, 0x00A, 0x00C, 0x00E):
+        elements.append((DECLTYPE_FLOAT3, DECLUSAGE_POSITION, 0))
+        nWeights = (position - 0x004) // 2
+        if nWeights > 4:
+            elements.append((DECLTYPE_FLOAT4, DECLUSAGE_BLENDWEIGHT, 0))
+            nWeights -= 4
+        elements.append((DECLTYPE_FLOAT1 + nWeights - 1, DECLUSAGE_BLENDWEIGHT, 0))
+    if fvf & 0x010:
+        elements.append((DECLTYPE_FLOAT3, DECLUSAGE_NORMAL, 0))
+    if fvf & 0x020:
+        elements.append((DECLTYPE_FLOAT1, DECLUSAGE_PSIZE, 0))
+    if fvf & 0x040:
+        elements.append((DECLTYPE_D3DCOLOR, DECLUSAGE_COLOR, 0))
+    if fvf & 0x080:
+        elements.append((DECLTYPE_D3DCOLOR, DECLUSAGE_COLOR, 1))
+    for i in range((fvf >> 8) & 0xF):
+        size = (fvf >> (16 + 2 * i)) & 3
+        declType = (DECLTYPE_FLOAT2, DECLTYPE_FLOAT3, DECLTYPE_FLOAT4, DECLTYPE_FLOAT1)[size]
+        elements.append((declType, DECLUSAGE_TEXCOORD, i))
+    return elements
+
+def decodeVertexElements(elements, data):
+    """Reinterpret the DWORD payload of DeclData/FVFData with a structured dtype.
+
+    Returns (usage, usageIndex, values) with values a float32 array of shape
+    (nVertices, components)."""
+    names = []
+    formats = []
+    offsets = []
+    stride = 0
+    for i, (declType, usage, usageIndex) in enumerate(elements):
+        if declType not in DECLTYPE_FORMATS:
+            raise RuntimeError("unknown vertex element type " + str(declType))
+        fmt, count, scale = DECLTYPE_FORMATS[declType]
+        names.append("e" + str(i))
+        formats.append((fmt, (count,)))
+        offsets.append(stride)
+        stride += numpy.dtype(fmt).itemsize * count
+    if stride == 0:
+        return []
+    nVertices = data.nbytes // stride
+    dtype = numpy.dtype({"names": names, "formats": formats, "offsets": offsets, "itemsize": stride})
+    records = numpy.ascontiguousarray(data, dtype="<u4").view(numpy.uint8)[:nVertices * stride].view(dtype)
+
+    result = []
+    for i, (declType, usage, usageIndex) in enumerate(elements):
+        fmt, count, scale = DECLTYPE_FORMATS[declType]
+        values = records["e" + str(i)]
+        if declType in (DECLTYPE_UDEC3, DECLTYPE_DEC3N):
+            packed = values[:, 0]
+            values = numpy.stack([(packed >> shift) & 0x3FF for shift in (0, 10, 20)], axis=1).astype(numpy.int32)
+            if declType == DECLTYPE_DEC3N:
+                values = (values ^ 0x200) - 0x200
+        values = values.astype(numpy.float32)
+        if scale is not None:
+            values *= scale
+        if declType == DECLTYPE_D3DCOLOR:
+            values = values[:, [2, 1, 0, 3]]
+        result.append((usage, usageIndex, values))
+    return result
 
 class Parser:
 
-    def __init__(self, fileName, config):
+    def __init__(self, fileName, config, cache=None):
         self.config    = config
+        self.cache     = cache
         self.tokenizer = Tokenizer(fileName)
         self.lookahead = self.tokenizer.getToken()
         self.materialDict = {}
+        self.createdObjects = []
+        # tells the objects of separate imports of the same file apart;
+        # fixed width so that later imports sort last
+        self.importId = "%017.6f" % time.time()
 
     def matchToken(self, kind, value=""):
         if self.lookahead.kind == kind and (value == "" or self.lookahead.value == value):
@@ -406,7 +867,10 @@ class Parser:
             if os.path.isfile(absPath):
                 try:
                     cTex = bpy.data.textures.new('Texture', type = 'IMAGE')
-                    cTex.image = bpy.data.images.load(absPath)
+                    if self.cache is None:
+                        cTex.image = bpy.data.images.load(absPath)
+                    else:
+                        cTex.image = self.cache.loadImage(absPath)
                     
                     mtex = material.texture_slots.add()
                     mtex.texture = cTex
@@ -489,6 +953,99 @@ class Parser:
 
         return texCoords
     
+    def parseDWordArray(self, nDWords):
+        if nDWords == 0:
+            self.checkSeparator()
+            return numpy.empty(0, dtype=numpy.uint32)
+        # the first value is already the lookahead token; the rest of the
+        # array is converted in one call instead of token by token
+        text = self.lookahead.value + self.tokenizer.readRawUntil(";")
+        self.lookahead = self.tokenizer.getToken()
+        if self.lookahead.kind == TK_SEMICOLON:
+            self.matchToken(TK_SEMICOLON)
+        data = numpy.fromstring(text, dtype=numpy.uint32, sep=",")
+        if len(data) != nDWords:
+            raise RuntimeError("("+str(self.tokenizer.lineno)+") expected " + str(nDWords) + " DWORDs")
+        return data
+
+    def parseDeclData(self):
+        val = self.matchToken(TK_LITERAL_NUM)
+        nElements = int(val)
+        self.matchToken(TK_SEMICOLON)
+        elements = []
+        for i in range(nElements):
+            fields = []
+            for j in range(4):
+                fields.append(int(self.matchToken(TK_LITERAL_NUM)))
+                self.matchToken(TK_SEMICOLON)
+            if i < nElements - 1:
+                self.checkSeparator()
+            # Type, Method, Usage, UsageIndex
+            elements.append((fields[0], fields[2], fields[3]))
+        self.checkSeparator()
+        val = self.matchToken(TK_LITERAL_NUM)
+        nDWords = int(val)
+        self.matchToken(TK_SEMICOLON)
+        data = self.parseDWordArray(nDWords)
+        return decodeVertexElements(elements, data)
+
+    def parseFVFData(self):
+        val = self.matchToken(TK_LITERAL_NUM)
+        fvf = int(val)
+        self.matchToken(TK_SEMICOLON)
+        val = self.matchToken(TK_LITERAL_NUM)
+        nDWords = int(val)
+        self.matchToken(TK_SEMICOLON)
+        data = self.parseDWordArray(nDWords)
+        return decodeVertexElements(fvfElements(fvf), data)
+
+    def convertDeclVectors(self, values):
+        # same axis conversion as parseMeshCoords
+        values = values[:, 0:3].copy()
+        if self.config.CoordinateSystem == 1:
+            values[:, 2] *= -1.0
+        if self.config.UpwardAxis == 1:
+            values = values[:, [0, 2, 1]]
+            values[:, 1] *= -1.0
+        return values
+
+    def applyDeclData(self, me, meshData):
+        # face indices are offset by the dummy vertex; loops follow the face
+        # corners in order, the same layout the texture coordinate code relies on
+        loopVertices = numpy.fromiter(itertools.chain.from_iterable(meshData.faces), dtype=numpy.int64) - 1
+        if len(loopVertices) != len(me.loops):
+            print("Cannot apply DeclData: face corner count mismatch")
+            return
+        for usage, usageIndex, values in meshData.declData:
+            if loopVertices.size and (len(values) == 0 or loopVertices.max() >= len(values)):
+                print("Cannot apply DeclData: vertex count mismatch")
+                continue
+            if usage == DECLUSAGE_TEXCOORD:
+                uvs = values[loopVertices, 0:2]
+                if values.shape[1] < 2:
+                    uvs = numpy.hstack([uvs, numpy.zeros((len(uvs), 1), dtype=numpy.float32)])
+                uvs[:, 1] = 1.0 - uvs[:, 1]
+                name = "TexCoord" + str(usageIndex)
+                if me.uv_textures.new(name) is None:
+                    print("Cannot add UV layer " + name + ": too many UV layers")
+                    continue
+                me.uv_layers[name].data.foreach_set("uv", uvs.ravel())
+            elif usage == DECLUSAGE_COLOR:
+                colors = values[loopVertices]
+                name = "Color" + str(usageIndex)
+                vcol = me.vertex_colors.new(name)
+                if vcol is None:
+                    print("Cannot add vertex color layer " + name + ": too many color layers")
+                    continue
+                nComponents = len(vcol.data[0].color) if len(vcol.data) else 3
+                vcol.data.foreach_set("color", colors[:, 0:nComponents].ravel())
+            elif usage in (DECLUSAGE_TANGENT, DECLUSAGE_BINORMAL) and values.shape[1] >= 3:
+                # meshes have no generic per-corner layers here, so keep the
+                # vectors as a flat x, y, z list per loop in a custom property
+                name = ("Tangent" if usage == DECLUSAGE_TANGENT else "Binormal") + str(usageIndex)
+                vectors = self.convertDeclVectors(values)[loopVertices]
+                me[name] = vectors.ravel().tolist()
+
     def parseMeshSubInstance(self, meshData):
 #        print(">" + self.lookahead.value)
         templateName = self.matchToken(TK_ID)
@@ -505,6 +1062,10 @@ class Parser:
             meshData.texCoords = self.parseMeshTextureCoords()
         elif templateName == "MeshVertexColors":
             self.vertexColors = self.parseMeshVertexColors()
+        elif templateName == "DeclData":
+            meshData.declData = self.parseDeclData()
+        elif templateName == "FVFData":
+            meshData.declData = self.parseFVFData()
         else:
             self.skipInstanceBlock()
     
@@ -512,6 +1073,20 @@ class Parser:
     
         return templateName
     
+    def setCustomSplitNormals(self, me, meshData):
+        # loops follow the face corners in order, the same assumption the texture
+        # coordinate code makes; faces may have any number of corners
+        faceNormals = numpy.fromiter(itertools.chain.from_iterable(meshData.faceNormals), dtype=numpy.int64)
+        if len(faceNormals) != len(me.loops):
+            print("Cannot set custom normals: face corner count mismatch")
+            return
+        normals = numpy.array(meshData.normals, dtype=numpy.float32)
+        if faceNormals.size and faceNormals.max() >= len(normals):
+            print("Cannot set custom normals: normal index out of range")
+            return
+        me.use_auto_smooth = True
+        me.normals_split_custom_set(normals[faceNormals])
+
     def parseMeshInstance(self):
         meshName = "Mesh"
         
@@ -526,7 +1101,15 @@ class Parser:
             if template == "MeshVertexColors":
                 hasVertexColors = True
         vnormals = None
-        if meshData.normals != None and meshData.faceNormals != None:
+        hasNormals = meshData.normals != None and meshData.faceNormals != None
+        # custom split normals need Blender 2.74; older versions split vertices
+        useCustomNormals = hasNormals and self.config.SplitNormals and hasattr(me, "normals_split_custom_set")
+        if hasNormals and self.config.SplitNormals and not useCustomNormals:
+            print("Custom split normals are not supported by this Blender; splitting vertices")
+        if useCustomNormals:
+            coords = meshData.coords
+            faces  = meshData.faces
+        elif hasNormals:
             comb = set([])
             for vf, nf in zip(meshData.faces, meshData.faceNormals):
                 for v, n in zip(vf, nf):
@@ -551,7 +1134,14 @@ class Parser:
         
         # create a mesh
         me.from_pydata(coords, [], faces)
+        me.polygons.foreach_set("use_smooth", [True] * len(me.polygons))
         
+        # keep the original vertices and apply MeshNormals per face corner;
+        # faces must already be smooth so that corners sharing a vertex form
+        # fans and differing normals get sharp edges instead of being averaged
+        if useCustomNormals:
+            self.setCustomSplitNormals(me, meshData)
+
         # set vertex normals if exist
         if vnormals != None and len(vnormals) == len(me.vertices):
             for i, v in enumerate(me.vertices):
@@ -575,6 +1165,9 @@ class Parser:
                     vc.uv = meshData.texCoords[vertexIndex]
                     index += 1
 
+        if meshData.declData != None:
+            self.applyDeclData(me, meshData)
+
         if meshData.vertexColors != None:
             vcol = me.vertex_colors.new("VertexColor")
             for i in range(len(meshData.faces)):
@@ -600,16 +1193,61 @@ class Parser:
                 if me.materials[me.polygons[i].material_index].texture_slots[0]:
                     uvs.data[i].image = me.materials[me.polygons[i].material_index].texture_slots[0].texture.image
     
+        self.removeDummyVertex(me)
         me.update()
     
         return me;
     
-    def parseFrameInstance(self, objectName):
+    def removeDummyVertex(self, me):
+        # vertex 0 is only a placeholder that no face uses; removing it on the
+        # mesh data avoids edit mode toggles on every imported object
+        bm = bmesh.new()
+        bm.from_mesh(me)
+        if hasattr(bm.verts, "ensure_lookup_table"):
+            bm.verts.ensure_lookup_table()
+        bm.verts.remove(bm.verts[0])
+        bm.to_mesh(me)
+        bm.free()
+
+    def parseFrameMatrix(self):
+        matrix = []
+        for i in range(16):
+            e = self.parseFloat()
+            matrix.append(e)
+            if i < 15:
+                self.matchToken(TK_COMMA)
+        self.matchToken(TK_SEMICOLON)
+        self.matchToken(TK_SEMICOLON)
+        row1 = matrix[0:4]
+        row2 = matrix[4:8]
+        row3 = matrix[8:12]
+        row4 = matrix[12:16]
+        frameMatrix = Matrix((tuple(row1), tuple(row2), tuple(row3), tuple(row4)))
+        frameMatrix.transpose()
+        if self.config.CoordinateSystem == 1:
+            sc = Matrix.Scale(-1, 4, Vector((0.0, 0.0, 1.0)))
+            frameMatrix = sc  * frameMatrix * sc
+        if self.config.UpwardAxis == 1:
+            frameMatrix = Matrix(((1,0,0,0),(0,0,-1,0),(0,1,0,0),(0,0,0,1))) * frameMatrix * Matrix(((1,0,0,0),(0,0,1,0),(0,-1,0,0),(0,0,0,1)))
+        return frameMatrix
+
+    def parseFrameHierarchy(self, objectName):
+        # Parses a Frame body and its nested Frames with an explicit stack instead of
+        # recursion, so the nesting depth is not bound by Python's recursion limit.
+        # Returns [name, matrix, mesh, parent record] records in pre-order, i.e.
+        # every parent precedes its children.
         frameMatrix = Matrix()
         frameMatrix.identity()
-        me = None
-        children = []
-        while self.lookahead.kind == TK_ID:
+        records = [[objectName, frameMatrix, None, -1]]
+        stack = [0]
+        while stack:
+            record = records[stack[-1]]
+            if self.lookahead.kind != TK_ID:
+                # end of the current Frame; the outermost closing brace is left to the caller
+                stack.pop()
+                if stack:
+                    self.matchToken(TK_RBRACE)
+                continue
             subInstName = self.matchToken(TK_ID)
             name = None
             if self.lookahead.kind == TK_ID:
@@ -619,56 +1257,43 @@ class Parser:
 #            print(subInstName + " at " + str(self.tokenizer.lineno))
     
             if subInstName == "FrameTransformMatrix":
-                matrix = []
-                for i in range(16):
-                    e = self.parseFloat()
-                    matrix.append(e)
-                    if i < 15:
-                        self.matchToken(TK_COMMA)
-                self.matchToken(TK_SEMICOLON)
-                self.matchToken(TK_SEMICOLON)
-                row1 = matrix[0:4]
-                row2 = matrix[4:8]
-                row3 = matrix[8:12]
-                row4 = matrix[12:16]
-                frameMatrix = Matrix((tuple(row1), tuple(row2), tuple(row3), tuple(row4)))
-                frameMatrix.transpose()
-                if self.config.CoordinateSystem == 1:
-                    sc = Matrix.Scale(-1, 4, Vector((0.0, 0.0, 1.0)))
-                    frameMatrix = sc  * frameMatrix * sc
-                if self.config.UpwardAxis == 1:
-                    frameMatrix = Matrix(((1,0,0,0),(0,0,-1,0),(0,1,0,0),(0,0,0,1))) * frameMatrix * Matrix(((1,0,0,0),(0,0,1,0),(0,-1,0,0),(0,0,0,1)))
+                record[1] = self.parseFrameMatrix()
             elif subInstName == "Mesh":
-                me = self.parseMeshInstance()
+                record[2] = self.parseMeshInstance()
             elif subInstName == "Frame":
-                c = self.parseFrameInstance(name)
-                children.append(c)
+                frameMatrix = Matrix()
+                frameMatrix.identity()
+                records.append([name, frameMatrix, None, stack[-1]])
+                stack.append(len(records) - 1)
+                continue
             else:
                 self.skipInstanceBlock()
             self.matchToken(TK_RBRACE)
-        if not me is None:
+        return records
+
+    def createFrameObjects(self, records):
+        # records are in pre-order, so each parent exists before its children
+        # and the hierarchy is built in a single pass
+        objects = []
+        for name, frameMatrix, me, parent in records:
             ob = bpy.data.objects.new("Frame", me)
-            bpy.context.scene.objects.link(ob)
-            ob.select = True
-            bpy.context.scene.objects.active = ob
-            bpy.context.tool_settings.mesh_select_mode = (True, False, False)
-            bpy.ops.object.mode_set(mode='EDIT')
-            bpy.ops.mesh.select_all(action = 'DESELECT')
-            bpy.ops.object.mode_set(mode='OBJECT')
-            me.vertices[0].select = True
-            bpy.ops.object.mode_set(mode='EDIT')
-            bpy.ops.mesh.delete(type='VERT')
-            bpy.ops.object.mode_set(mode='OBJECT')
-        else:
-            ob = bpy.data.objects.new("Frame", None)
-            bpy.context.scene.objects.link(ob)
-        if objectName != None:
-            ob.name = objectName
-        ob.matrix_local = frameMatrix
-        for c in children:
-            c.parent = ob
-    
-        return ob
+            if name != None:
+                ob.name = name
+            if parent >= 0:
+                ob.parent = objects[parent]
+            ob.matrix_local = frameMatrix
+            objects.append(ob)
+        scene = bpy.context.scene
+        for ob in objects:
+            scene.objects.link(ob)
+            if ob.type == 'MESH':
+                ob.select = True
+        self.createdObjects.extend(objects)
+        return objects
+
+    def parseFrameInstance(self, objectName):
+        records = self.parseFrameHierarchy(objectName)
+        return self.createFrameObjects(records)[0]
     
     def parseInstanse(self):
         instName = None
@@ -679,23 +1304,15 @@ class Parser:
         
         self.matchToken(TK_LBRACE)
     
+        ob = None
         if templateName == "Mesh":
             me = self.parseMeshInstance()
             ob = bpy.data.objects.new("Frame", me)
             bpy.context.scene.objects.link(ob)
-            
             ob.select = True
-            bpy.context.scene.objects.active = ob
-            bpy.context.tool_settings.mesh_select_mode = (True, False, False)
-            bpy.ops.object.mode_set(mode='EDIT')
-            bpy.ops.mesh.select_all(action = 'DESELECT')
-            bpy.ops.object.mode_set(mode='OBJECT')
-            me.vertices[0].select = True
-            bpy.ops.object.mode_set(mode='EDIT')
-            bpy.ops.mesh.delete(type='VERT')
-            bpy.ops.object.mode_set(mode='OBJECT')
+            self.createdObjects.append(ob)
         elif templateName == "Frame":
-            self.parseFrameInstance(instName)
+            ob = self.parseFrameInstance(instName)
         elif templateName == "Material":
             self.parseMaterialOnTopLevel(instName)
         elif templateName == "Header":
@@ -704,7 +1321,187 @@ class Parser:
             self.skipInstanceBlock()
     
         self.matchToken(TK_RBRACE)
-    
+
+        return ob
+
+    def openRange(self, offset, size):
+        self.tokenizer.shutdown()
+        self.tokenizer = Tokenizer(self.tokenizer.filePath, offset, offset + size)
+        self.lookahead = self.tokenizer.getToken()
+
+    def parseBlock(self, block):
+        self.openRange(block.offset, block.size)
+        return self.parseInstanse()
+
+    def parseLocalMatrix(self, block):
+        # only the FrameTransformMatrix range of a Frame is read
+        if block.kind != "Frame" or block.matrixOffset < 0:
+            frameMatrix = Matrix()
+            frameMatrix.identity()
+            return frameMatrix
+        self.openRange(block.matrixOffset, block.matrixSize)
+        self.matchToken(TK_ID, "FrameTransformMatrix")
+        self.matchToken(TK_LBRACE)
+        frameMatrix = self.parseFrameMatrix()
+        self.matchToken(TK_RBRACE)
+        return frameMatrix
+
+    def parseMeshBlock(self, block):
+        self.openRange(block.offset, block.size)
+        self.matchToken(TK_ID, "Mesh")
+        if self.lookahead.kind == TK_ID:
+            self.matchToken(TK_ID)
+        self.matchToken(TK_LBRACE)
+        me = self.parseMeshInstance()
+        self.matchToken(TK_RBRACE)
+        return me
+
+    def tagObject(self, ob, fileName, key, frameHash, meshHash):
+        ob["x_source"] = fileName
+        ob["x_path"] = key          # blockKeys hash of the block path
+        ob["x_hash"] = frameHash
+        ob["x_mesh_hash"] = meshHash
+        ob["x_import"] = self.importId
+
+    def tagMaterial(self, m, fileName, name, materialHash):
+        m["x_source"] = fileName
+        m["x_name"] = name
+        m["x_hash"] = materialHash
+        m["x_import"] = self.importId
+
+    def freeMesh(self, me):
+        # inline materials belong to their mesh; top-level ones are freed by
+        # the update itself once nothing uses them
+        materials = [m for m in me.materials if m is not None and "x_source" not in m]
+        if me.users == 0:
+            bpy.data.meshes.remove(me)
+        for m in materials:
+            if m.users == 0:
+                bpy.data.materials.remove(m)
+
+    def tagImport(self, blocks, hashes):
+        # remember which block every object of a plain import came from, so a
+        # later update can match them; createdObjects follows objectBlocks order
+        fileName = os.path.abspath(self.tokenizer.filePath)
+        keys = blockKeys(blocks)
+        items = objectBlocks(blocks)
+        if len(items) != len(self.createdObjects):
+            print("Cannot tag imported objects: block index does not match the parsed frames")
+            return
+        for (i, meshIndex), ob in zip(items, self.createdObjects):
+            frameHash = hashes[i] if blocks[i].kind == "Frame" else ""
+            meshHash = hashes[meshIndex] if meshIndex >= 0 else ""
+            self.tagObject(ob, fileName, keys[i], frameHash, meshHash)
+        for b, h in zip(blocks, hashes):
+            if b.kind == "Material" and b.parent < 0 and b.name in self.materialDict:
+                self.tagMaterial(self.materialDict[b.name], fileName, b.name, h)
+
+    def readXFileUpdate(self, blocks, hashes):
+        fileName = os.path.abspath(self.tokenizer.filePath)
+        scene = bpy.context.scene
+        keys = blockKeys(blocks)
+
+        # only objects tagged by an earlier import or update of this file are
+        # matched; if the file was imported more than once, the latest copy is
+        # updated and the others are left alone
+        tagged = [ob for ob in scene.objects if ob.get("x_source") == fileName and "x_path" in ob]
+        copies = set(ob.get("x_import", "") for ob in tagged)
+        if copies:
+            self.importId = max(copies)
+            if len(copies) > 1:
+                print("%d imports of %s found, updating the latest one" % (len(copies), fileName))
+        existing = {}
+        for ob in tagged:
+            if ob.get("x_import", "") == self.importId:
+                existing.setdefault(ob["x_path"], ob)
+        oldMaterials = {}
+        for m in bpy.data.materials:
+            if m.get("x_source") == fileName and m.get("x_import", "") == self.importId:
+                oldMaterials[m["x_name"]] = m
+
+        # decide per object whether its mesh and/or its transform must be rebuilt
+        plan = []
+        needed = set()
+        for i, meshIndex in objectBlocks(blocks):
+            ob = existing.get(keys[i])
+            frameHash = hashes[i] if blocks[i].kind == "Frame" else ""
+            meshHash = hashes[meshIndex] if meshIndex >= 0 else ""
+            if ob is not None and (ob.type == 'MESH') != (meshIndex >= 0):
+                ob = None
+            rebuildMesh = meshIndex >= 0 and (ob is None or ob.get("x_mesh_hash") != meshHash)
+            rebuildTransform = ob is None or ob.get("x_hash") != frameHash
+            if rebuildMesh:
+                needed.update(blocks[meshIndex].materials)
+            plan.append((i, meshIndex, ob, frameHash, meshHash, rebuildMesh, rebuildTransform))
+
+        for b, h in zip(blocks, hashes):
+            if b.kind != "Material" or b.parent >= 0:
+                continue
+            m = oldMaterials.get(b.name)
+            if m is not None and m.get("x_hash") == h:
+                self.materialDict[b.name] = m
+            elif b.name in needed:
+                self.parseBlock(b)
+                self.tagMaterial(self.materialDict[b.name], fileName, b.name, h)
+
+        objects = {}
+        kept = set()
+        for i, meshIndex, ob, frameHash, meshHash, rebuildMesh, rebuildTransform in plan:
+            b = blocks[i]
+            me = self.parseMeshBlock(blocks[meshIndex]) if rebuildMesh else None
+            if ob is None:
+                ob = bpy.data.objects.new("Frame", me)
+                scene.objects.link(ob)
+                # named like a plain import: only frames take their block name
+                if b.kind == "Frame" and b.name is not None:
+                    ob.name = b.name
+            elif me is not None:
+                oldMesh = ob.data
+                ob.data = me
+                self.freeMesh(oldMesh)
+            if rebuildTransform:
+                ob.matrix_local = self.parseLocalMatrix(b)
+            self.tagObject(ob, fileName, keys[i], frameHash, meshHash)
+            objects[i] = ob
+            kept.add(ob.name)
+            parent = objects[b.parent] if b.parent >= 0 else None
+            if ob.parent != parent:
+                ob.parent = parent
+
+        # drop matched objects whose blocks are gone or changed type
+        for ob in existing.values():
+            if ob.name not in kept:
+                me = ob.data if ob.type == 'MESH' else None
+                scene.objects.unlink(ob)
+                bpy.data.objects.remove(ob)
+                if me is not None:
+                    self.freeMesh(me)
+        for m in oldMaterials.values():
+            if m.users == 0:
+                bpy.data.materials.remove(m)
+
+        self.tokenizer.shutdown()
+
+    def readXFileBlocks(self, index, blocks):
+        # a nested block is placed under the product of its ancestors' transforms
+        worldMatrices = {}
+        for b in blocks:
+            ob = self.parseBlock(b)
+            if ob is None or b.parent < 0:
+                continue
+            chain = []
+            p = b.parent
+            while p >= 0 and p not in worldMatrices:
+                chain.append(p)
+                p = index[p].parent
+            for p in reversed(chain):
+                local = self.parseLocalMatrix(index[p])
+                parent = index[p].parent
+                worldMatrices[p] = worldMatrices[parent] * local if parent >= 0 else local
+            ob.matrix_local = worldMatrices[b.parent] * ob.matrix_local
+
+        self.tokenizer.shutdown()
+
     def readXFile(self):
         self.parseFileHeader()
     
@@ -715,9 +1512,6 @@ class Parser:
             self.parseInstanse()
     
         self.tokenizer.shutdown()
-    
-        if bpy.ops.object.shade_smooth.poll():
-            bpy.ops.object.shade_smooth()
 
 ########
 
@@ -731,22 +1525,523 @@ UpAxisSelect = (
     ("2", "Z-axis up", ""),
     )
 
-def importXFile(filepath, config):
+def importXFile(filepath, config, cache=None):
     fileName = os.path.expanduser(filepath)
     if fileName:
         (shortName, ext) = os.path.splitext(fileName)
         if ext.lower() != ".x":
             print("Error: Not a x file: " + fileName)
             return
-        parser = Parser(fileName, config)
+        parser = Parser(fileName, config, cache)
         parser.readXFile()
+        if config.TrackChanges:
+            # the block scanner is stricter than the parser, so a file that
+            # imported fine is still imported, just without tags
+            try:
+                blocks = readBlockIndex(fileName, cache)
+            except RuntimeError as e:
+                print("Cannot track changes of " + fileName + ": " + str(e))
+            else:
+                parser.tagImport(blocks, blockHashes(fileName, blocks, hashSalt(config)))
         bpy.context.scene.update()
         print("Done")
         return
     print("Error: Not a x file: " + filepath)
     return
 
-class IMPORT_OT_directx_x(bpy.types.Operator):
+def importXFileBlocks(filepath, config, selection, cache=None):
+    # selection holds block indexes or "/"-separated block paths
+    fileName = xFileName(filepath)
+    if fileName is None:
+        print("Error: Not a x file: " + filepath)
+        return
+    index = readBlockIndex(fileName, cache)
+    paths = [s for s in selection if not isinstance(s, int)]
+    indices = [s for s in selection if isinstance(s, int)] + findBlocks(index, paths)
+    parser = Parser(fileName, config, cache)
+    parser.readXFileBlocks(index, selectBlocks(index, indices))
+    bpy.context.scene.update()
+    print("Done")
+
+#
+#    Export
+#
+XB_TOKEN_NAME         = 1
+XB_TOKEN_STRING       = 2
+XB_TOKEN_INTEGER_LIST = 6
+XB_TOKEN_FLOAT_LIST   = 7
+XB_TOKEN_OBRACE       = 10
+XB_TOKEN_CBRACE       = 11
+XB_TOKEN_SEMICOLON    = 20
+
+ExportFormats = (
+    ("TXT", "Text", ""),
+    ("BIN", "Binary", ""),
+    )
+
+class ExportSettings:
+    def __init__(self, CoordinateSystem=1,UpwardAxis=1,Format="TXT"):
+        self.CoordinateSystem = int(CoordinateSystem)
+        self.UpwardAxis = int(UpwardAxis)
+        self.Format = Format
+
+exportNamePattern = re.compile(r'[^A-Za-z0-9_\-]')
+
+def exportName(name):
+    # the importer only accepts [A-Za-z_][A-Za-z0-9_-]* as instance names
+    name = exportNamePattern.sub("_", name)
+    if not name or not (name[0].isalpha() or name[0] == "_"):
+        name = "_" + name
+    return name
+
+def faceValues(totals, indices):
+    # interleave the corner count in front of each face's indices
+    values = numpy.empty(len(totals) + len(indices), dtype=numpy.int64)
+    countPos = numpy.cumsum(totals) - totals + numpy.arange(len(totals))
+    mask = numpy.ones(len(values), dtype=bool)
+    mask[countPos] = False
+    values[countPos] = totals
+    values[mask] = indices
+    return values
+
+class TextXWriter:
+    def __init__(self, fp):
+        self.fp = fp
+        self.faceFormats = {}
+
+    def header(self):
+        self.fp.write("xof 0303txt 0032\n")
+
+    def beginBlock(self, template, name=None):
+        if name is None:
+            self.fp.write(template + " {\n")
+        else:
+            self.fp.write(template + " " + name + " {\n")
+
+    def endBlock(self):
+        self.fp.write("}\n")
+
+    def reference(self, name):
+        self.fp.write("{ " + name + " }\n")
+
+    def count(self, n):
+        self.fp.write("%d;\n" % n)
+
+    def scalar(self, value):
+        self.fp.write("%.6f;\n" % value)
+
+    def record(self, values):
+        self.fp.write(";".join(["%.6f" % v for v in values]) + ";;\n")
+
+    def string(self, value):
+        self.fp.write('"' + value.replace("\\", "/") + '";\n')
+
+    def matrix(self, values):
+        self.fp.write(",".join(["%.6f" % v for v in values]) + ";;\n")
+
+    def vectorArray(self, arr):
+        if len(arr) == 0:
+            self.fp.write(";\n")
+            return
+        rowFormat = ";".join(["%.6f"] * arr.shape[1]) + ";,\n"
+        body = (rowFormat * len(arr)) % tuple(arr.ravel().tolist())
+        self.fp.write(body[:-2] + ";\n")
+
+    def intArray(self, arr):
+        if len(arr) == 0:
+            self.fp.write(";\n")
+            return
+        body = ("%d,\n" * len(arr)) % tuple(arr.tolist())
+        self.fp.write(body[:-2] + ";;\n")
+
+    def faceArray(self, totals, indices):
+        if len(totals) == 0:
+            self.fp.write(";\n")
+            return
+        formats = []
+        for k in totals.tolist():
+            if k not in self.faceFormats:
+                self.faceFormats[k] = "%d;" + ",".join(["%d"] * k) + ";,\n"
+            formats.append(self.faceFormats[k])
+        values = faceValues(totals, indices)
+        body = "".join(formats) % tuple(values.tolist())
+        self.fp.write(body[:-2] + ";\n")
+
+class BinaryXWriter:
+    def __init__(self, fp):
+        self.fp = fp
+
+    def token(self, kind):
+        self.fp.write(numpy.array([kind], dtype="<u2").tobytes())
+
+    def name(self, value):
+        data = value.encode("ascii")
+        self.token(XB_TOKEN_NAME)
+        self.fp.write(numpy.array([len(data)], dtype="<u4").tobytes() + data)
+
+    def integers(self, values):
+        values = numpy.asarray(values, dtype="<u4").ravel()
+        self.token(XB_TOKEN_INTEGER_LIST)
+        self.fp.write(numpy.array([len(values)], dtype="<u4").tobytes() + values.tobytes())
+
+    def floats(self, values):
+        values = numpy.asarray(values, dtype="<f4").ravel()
+        self.token(XB_TOKEN_FLOAT_LIST)
+        self.fp.write(numpy.array([len(values)], dtype="<u4").tobytes() + values.tobytes())
+
+    def header(self):
+        self.fp.write(b"xof 0303bin 0032")
+
+    def beginBlock(self, template, name=None):
+        self.name(template)
+        if name is not None:
+            self.name(name)
+        self.token(XB_TOKEN_OBRACE)
+
+    def endBlock(self):
+        self.token(XB_TOKEN_CBRACE)
+
+    def reference(self, name):
+        self.token(XB_TOKEN_OBRACE)
+        self.name(name)
+        self.token(XB_TOKEN_CBRACE)
+
+    def count(self, n):
+        self.integers([n])
+
+    def scalar(self, value):
+        self.floats([value])
+
+    def record(self, values):
+        self.floats(values)
+
+    def string(self, value):
+        data = value.replace("\\", "/").encode(locale.getpreferredencoding(False))
+        self.token(XB_TOKEN_STRING)
+        self.fp.write(numpy.array([len(data)], dtype="<u4").tobytes() + data)
+        self.fp.write(numpy.array([XB_TOKEN_SEMICOLON], dtype="<u4").tobytes())
+
+    def matrix(self, values):
+        self.floats(values)
+
+    def vectorArray(self, arr):
+        self.floats(arr)
+
+    def intArray(self, arr):
+        self.integers(arr)
+
+    def faceArray(self, totals, indices):
+        self.integers(faceValues(totals, indices))
+
+class Exporter:
+
+    def __init__(self, filePath, config):
+        self.filePath = filePath
+        self.config   = config
+        self.materialNames = {}
+        self.usedNames = set()
+
+    def uniqueName(self, name):
+        # distinct Blender names may sanitize to the same .x name
+        name = exportName(name)
+        unique = name
+        n = 1
+        while unique in self.usedNames:
+            unique = "%s_%d" % (name, n)
+            n += 1
+        self.usedNames.add(unique)
+        return unique
+
+    def convertVectors(self, arr):
+        # inverse of the axis conversion in Parser.parseMeshCoords
+        if self.config.UpwardAxis == 1:
+            arr = arr[:, [0, 2, 1]]
+            arr[:, 2] *= -1.0
+        else:
+            arr = arr.copy()
+        if self.config.CoordinateSystem == 1:
+            arr[:, 2] *= -1.0
+        return arr
+
+    def convertMatrix(self, m):
+        # inverse of the conversion in Parser.parseFrameMatrix, written row by row
+        m = numpy.array(m, dtype=numpy.float64)
+        if self.config.UpwardAxis == 1:
+            a = numpy.array(((1,0,0,0),(0,0,-1,0),(0,1,0,0),(0,0,0,1)), dtype=numpy.float64)
+            m = a.T.dot(m).dot(a)
+        if self.config.CoordinateSystem == 1:
+            sc = numpy.diag((1.0, 1.0, -1.0, 1.0))
+            m = sc.dot(m).dot(sc)
+        return m.T.ravel()
+
+    def writeMaterial(self, w, material):
+        if material is None:
+            # stands in for empty material slots so face indices stay valid
+            w.beginBlock("Material", self.materialNames[None])
+            w.record((0.8, 0.8, 0.8, 1.0))
+            w.scalar(0.0)
+            w.record((1.0, 1.0, 1.0))
+            w.record((0.0, 0.0, 0.0))
+            w.endBlock()
+            return
+        name = self.materialNames[material.name]
+        w.beginBlock("Material", name)
+        w.record(list(material.diffuse_color)[0:3] + [getattr(material, "alpha", 1.0)])
+        w.scalar(getattr(material, "specular_hardness", 0.0))
+        w.record(list(material.specular_color)[0:3])
+        w.record((0.0, 0.0, 0.0))
+        for slot in getattr(material, "texture_slots", ()):
+            if slot and slot.texture and getattr(slot.texture, "image", None):
+                absPath = bpy.path.abspath(slot.texture.image.filepath)
+                try:
+                    relPath = os.path.relpath(absPath, os.path.dirname(self.filePath))
+                except ValueError:
+                    relPath = absPath
+                w.beginBlock("TextureFilename")
+                w.string(relPath)
+                w.endBlock()
+                break
+        w.endBlock()
+
+    def writeMesh(self, w, ob):
+        me = ob.data
+        nVertices = len(me.vertices)
+        nLoops    = len(me.loops)
+        nPolygons = len(me.polygons)
+
+        co = numpy.empty(nVertices * 3, dtype=numpy.float32)
+        me.vertices.foreach_get("co", co)
+        loopVertices = numpy.empty(nLoops, dtype=numpy.int32)
+        me.loops.foreach_get("vertex_index", loopVertices)
+        loopStart = numpy.empty(nPolygons, dtype=numpy.int32)
+        me.polygons.foreach_get("loop_start", loopStart)
+        loopTotal = numpy.empty(nPolygons, dtype=numpy.int32)
+        me.polygons.foreach_get("loop_total", loopTotal)
+        materialIndex = numpy.empty(nPolygons, dtype=numpy.int32)
+        me.polygons.foreach_get("material_index", materialIndex)
+
+        if hasattr(me, "calc_normals_split"):
+            me.calc_normals_split()
+            normals = numpy.empty(nLoops * 3, dtype=numpy.float32)
+            me.loops.foreach_get("normal", normals)
+            me.free_normals_split()
+            normals = normals.reshape(-1, 3)
+        else:
+            vnormals = numpy.empty(nVertices * 3, dtype=numpy.float32)
+            me.vertices.foreach_get("normal", vnormals)
+            normals = vnormals.reshape(-1, 3)[loopVertices]
+
+        uvs = None
+        if me.uv_layers.active is not None:
+            uvs = numpy.empty(nLoops * 2, dtype=numpy.float32)
+            me.uv_layers.active.data.foreach_get("uv", uvs)
+            uvs = uvs.reshape(-1, 2)
+
+        # .x stores normals and texture coordinates per vertex, so split
+        # vertices wherever the face corners disagree
+        keys = [loopVertices.reshape(-1, 1), normals]
+        if uvs is not None:
+            keys.append(uvs)
+        # rows are compared as raw bytes, since numpy.unique only got axis= in 1.13
+        keys = numpy.ascontiguousarray(numpy.hstack(keys).astype(numpy.float64) + 0.0)
+        rows = keys.view(numpy.dtype((numpy.void, keys.dtype.itemsize * keys.shape[1]))).ravel()
+        rows, first, inverse = numpy.unique(rows, return_index=True, return_inverse=True)
+        inverse = inverse.ravel()
+        coords = co.reshape(-1, 3)[loopVertices[first]]
+
+        # loops of each polygon, reversed for the left-handed winding
+        polygonOfLoop = numpy.repeat(numpy.arange(nPolygons), loopTotal)
+        corner = numpy.arange(nLoops) - numpy.repeat(numpy.cumsum(loopTotal) - loopTotal, loopTotal)
+        if self.config.CoordinateSystem == 1:
+            corner = loopTotal[polygonOfLoop] - 1 - corner
+        loopOrder = loopStart[polygonOfLoop] + corner
+        faceIndices = inverse[loopOrder]
+
+        w.beginBlock("Mesh", self.uniqueName(me.name))
+        w.count(len(coords))
+        w.vectorArray(self.convertVectors(coords))
+        w.count(nPolygons)
+        w.faceArray(loopTotal, faceIndices)
+
+        w.beginBlock("MeshNormals")
+        w.count(len(coords))
+        w.vectorArray(self.convertVectors(normals[first]))
+        w.count(nPolygons)
+        w.faceArray(loopTotal, faceIndices)
+        w.endBlock()
+
+        if uvs is not None:
+            texCoords = uvs[first].astype(numpy.float64)
+            texCoords[:, 1] = 1.0 - texCoords[:, 1]
+            w.beginBlock("MeshTextureCoords")
+            w.count(len(texCoords))
+            w.vectorArray(texCoords)
+            w.endBlock()
+
+        materials = list(me.materials)
+        if materials:
+            w.beginBlock("MeshMaterialList")
+            w.count(len(materials))
+            w.count(nPolygons)
+            w.intArray(numpy.minimum(materialIndex, len(materials) - 1))
+            for m in materials:
+                w.reference(self.materialNames[m.name if m is not None else None])
+            w.endBlock()
+
+        w.endBlock()
+
+    def writeFrames(self, w, roots, children):
+        # explicit stack instead of recursion so deep hierarchies can be written;
+        # None marks the end of the Frame opened below it
+        stack = list(reversed(roots))
+        while stack:
+            ob = stack.pop()
+            if ob is None:
+                w.endBlock()
+                continue
+            w.beginBlock("Frame", self.uniqueName(ob.name))
+            w.beginBlock("FrameTransformMatrix")
+            w.matrix(self.convertMatrix(ob.matrix_local))
+            w.endBlock()
+            if ob.type == 'MESH':
+                self.writeMesh(w, ob)
+            stack.append(None)
+            stack.extend(reversed(children.get(ob.name, [])))
+
+    def writeXFile(self, objects):
+        exported = set(ob.name for ob in objects)
+        roots = []
+        children = {}
+        for ob in objects:
+            if ob.parent is not None and ob.parent.name in exported:
+                children.setdefault(ob.parent.name, []).append(ob)
+            else:
+                roots.append(ob)
+        materials = []
+        for ob in objects:
+            if ob.type == 'MESH':
+                for m in ob.data.materials:
+                    key = m.name if m is not None else None
+                    if key not in self.materialNames:
+                        self.materialNames[key] = self.uniqueName(m.name if m is not None else "DefaultMaterial")
+                        materials.append(m)
+
+        if self.config.Format == "BIN":
+            fp = open(self.filePath, "wb", buffering=1 << 20)
+            w = BinaryXWriter(fp)
+        else:
+            fp = open(self.filePath, "w", buffering=1 << 20)
+            w = TextXWriter(fp)
+        try:
+            w.header()
+            for m in materials:
+                self.writeMaterial(w, m)
+            self.writeFrames(w, roots, children)
+        finally:
+            fp.close()
+
+def exportXFile(filepath, config, objects=None):
+    fileName = os.path.expanduser(filepath)
+    if not fileName:
+        print("Error: Not a x file: " + filepath)
+        return
+    if objects is None:
+        objects = bpy.context.scene.objects
+    exporter = Exporter(bpy.path.ensure_ext(fileName, ".x"), config)
+    exporter.writeXFile(list(objects))
+    print("Done")
+
+def updateXFile(filepath, config, cache=None):
+    fileName = xFileName(filepath)
+    if fileName is None:
+        print("Error: Not a x file: " + filepath)
+        return
+    try:
+        blocks = readBlockIndex(fileName, cache)
+    except RuntimeError as e:
+        print("Error: Cannot read blocks of " + fileName + ": " + str(e))
+        return
+    hashes = blockHashes(fileName, blocks, hashSalt(config))
+    parser = Parser(fileName, config, cache)
+    parser.readXFileUpdate(blocks, hashes)
+    bpy.context.scene.update()
+    print("Done")
+
+class ImportProperties:
+    # import options shared by the import operators
+
+    CoordinateSystem = EnumProperty(
+        name="Src System",
+        description="Select a coordinate system to import from",
+        items=CoordinateSystems,
+        default="1")
+
+    UpwardAxis = EnumProperty(
+        name="Src Up-Axis",
+        description="Select a upward vector to import from",
+        items=UpAxisSelect,
+        default="1")
+
+    SplitNormals = BoolProperty(
+        name="Custom Split Normals",
+        description="Keep the original vertices and apply MeshNormals as custom split normals",
+        default=False)
+
+    def importSettings(self):
+        return ImportSettings(
+                    CoordinateSystem=self.CoordinateSystem,
+                    UpwardAxis=self.UpwardAxis,
+                    SplitNormals=self.SplitNormals
+                 )
+
+class DirectXBlockItem(bpy.types.PropertyGroup):
+    index = IntProperty()
+    label = StringProperty()
+    selected = BoolProperty(default=False)
+
+class IMPORT_OT_directx_x_blocks(bpy.types.Operator, ImportProperties):
+    '''Import chosen frames and meshes from X file format (.x)'''
+    bl_idname = "import_scene.directx_x_blocks"
+    bl_description = 'Import chosen frames and meshes from X file format (.x)'
+    bl_label = "Import DirectX Blocks"
+    bl_options = {'UNDO'}
+
+    filepath = StringProperty(subtype='FILE_PATH')
+    blocks = CollectionProperty(type=DirectXBlockItem)
+
+    def draw(self, context):
+        col = self.layout.column(align=True)
+        for item in self.blocks:
+            col.prop(item, "selected", text=item.label)
+
+    def execute(self, context):
+        config = self.importSettings()
+        indices = [item.index for item in self.blocks if item.selected]
+        importXFileBlocks(self.filepath, config, indices)
+        return {'FINISHED'}
+
+    def invoke(self, context, event):
+        self.blocks.clear()
+        fileName = xFileName(self.filepath)
+        if fileName is None:
+            self.report({'ERROR'}, "Not a x file: " + self.filepath)
+            return {'CANCELLED'}
+        try:
+            index = loadBlockIndex(fileName)
+        except (OSError, RuntimeError) as e:
+            self.report({'ERROR'}, "Cannot read blocks of " + fileName + ": " + str(e))
+            return {'CANCELLED'}
+        for i, b in enumerate(index):
+            if b.kind == "Material":
+                continue
+            item = self.blocks.add()
+            item.index = i
+            item.label = "    " * min(b.depth, 16) + b.segment
+            if b.kind == "Mesh":
+                item.label += " (%d verts, %d faces)" % (b.vertices, b.faces)
+        return context.window_manager.invoke_props_dialog(self)
+
+class IMPORT_OT_directx_x(bpy.types.Operator, ImportProperties):
     '''Import from X file format (.x)'''
     bl_idname = "import_scene.directx_x"
     bl_description = 'Import from X file format (.x)'
@@ -755,31 +2050,83 @@ class IMPORT_OT_directx_x(bpy.types.Operator):
 #    bl_region_type = "WINDOW"
     bl_options = {'UNDO'}
     
+    filepath = StringProperty(subtype='FILE_PATH')
+    filter_glob = StringProperty(default="*.x", options={'HIDDEN'})
+    SelectBlocks = BoolProperty(
+        name="Select Blocks",
+        description="Choose which frames and meshes to import before parsing",
+        default=False)
+
+    UpdateExisting = BoolProperty(
+        name="Update Existing",
+        description="Rebuild only the frames, meshes and materials that changed since the last import of this file",
+        default=False)
+
+    TrackChanges = BoolProperty(
+        name="Track Changes",
+        description="Tag the imported objects so that Update Existing can rebuild only what changed later",
+        default=False)
+
+    def execute(self, context):
+        if self.SelectBlocks:
+            bpy.ops.import_scene.directx_x_blocks('INVOKE_DEFAULT',
+                filepath=self.filepath,
+                CoordinateSystem=self.CoordinateSystem,
+                UpwardAxis=self.UpwardAxis,
+                SplitNormals=self.SplitNormals)
+            return {'FINISHED'}
+        config = self.importSettings()
+        config.TrackChanges = self.TrackChanges
+        if self.UpdateExisting:
+            updateXFile(self.filepath, config)
+        else:
+            importXFile(self.filepath, config)
+        return {'FINISHED'}
+
+    def invoke(self, context, event):
+        wm = context.window_manager
+        wm.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+class EXPORT_OT_directx_x(bpy.types.Operator):
+    '''Export to X file format (.x)'''
+    bl_idname = "export_scene.directx_x"
+    bl_description = 'Export to X file format (.x)'
+    bl_label = "Export DirectX"
+
     filepath = StringProperty(subtype='FILE_PATH')
     filter_glob = StringProperty(default="*.x", options={'HIDDEN'})
 
-    #Coordinate System
     CoordinateSystem = EnumProperty(
-        name="Src System",
-        description="Select a coordinate system to import from",
+        name="Dst System",
+        description="Select a coordinate system to export to",
         items=CoordinateSystems,
         default="1")
 
     UpwardAxis = EnumProperty(
-        name="Src Up-Axis",
-        description="Select a upward vector to import from",
+        name="Dst Up-Axis",
+        description="Select a upward vector to export to",
         items=UpAxisSelect,
         default="1")
 
+    Format = EnumProperty(
+        name="Format",
+        description="Select the encoding of the exported file",
+        items=ExportFormats,
+        default="TXT")
+
     def execute(self, context):
-        config = ImportSettings(
+        config = ExportSettings(
                     CoordinateSystem=self.CoordinateSystem,
-                    UpwardAxis=self.UpwardAxis
+                    UpwardAxis=self.UpwardAxis,
+                    Format=self.Format
                  )
-        importXFile(self.filepath, config)
+        exportXFile(self.filepath, config)
         return {'FINISHED'}
 
     def invoke(self, context, event):
+        if not self.filepath:
+            self.filepath = bpy.path.ensure_ext(os.path.splitext(bpy.data.filepath)[0] or "untitled", ".x")
         wm = context.window_manager
         wm.fileselect_add(self)
         return {'RUNNING_MODAL'}
@@ -787,15 +2134,230 @@ class IMPORT_OT_directx_x(bpy.types.Operator):
 def menu_func(self, context):
     self.layout.operator(IMPORT_OT_directx_x.bl_idname, text="DirectX (.x)")
 
+def menu_func_export(self, context):
+    self.layout.operator(EXPORT_OT_directx_x.bl_idname, text="DirectX (.x)")
+
 def register():
     bpy.utils.register_module(__name__)
 
     bpy.types.INFO_MT_file_import.append(menu_func)
+    bpy.types.INFO_MT_file_export.append(menu_func_export)
 
 def unregister():
     bpy.utils.unregister_module(__name__)
 
     bpy.types.INFO_MT_file_import.remove(menu_func)
+    bpy.types.INFO_MT_file_export.remove(menu_func_export)
+
+#
+#    Worker
+#
+def residentMemory():
+    """Resident set size of this process in MB."""
+    try:
+        with open("/proc/self/statm", "r") as fp:
+            return int(fp.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024.0 * 1024.0)
+    except (OSError, ValueError, IndexError):
+        import resource
+        # peak rather than current usage; ru_maxrss is in KB on Linux, bytes on macOS
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":
+            rss /= 1024.0
+        return rss / 1024.0
+
+class ImportWorker:
+    """Runs import/convert jobs one after another inside a single Blender process.
+
+    Each job is a JSON object, one per line:
+        {"id": 1, "command": "import", "filepath": "a.x", "settings": {"UpwardAxis": 2}}
+        {"id": 2, "command": "convert", "filepath": "a.x", "output": "a.blend"}
+    "blocks" limits the import to the given block index paths, and an "output"
+    ending in .x is written with the exporter ("settings" may then hold "Format").
+    "ping" and "quit" take no arguments. Each job is answered with one JSON line
+    holding "ok", "objects", "timings" and "recycle"; once "recycle" is true the
+    worker stops and should be restarted by its supervisor.
+    """
+
+    def __init__(self, maxJobs=200, maxMemory=4096):
+        self.cache     = ImportCache()
+        self.maxJobs   = maxJobs
+        self.maxMemory = maxMemory
+        self.jobCount  = 0
+        self.stopRequested = False
+
+    def resetScene(self):
+        scene = bpy.context.scene
+        for ob in list(scene.objects):
+            scene.objects.unlink(ob)
+        for ob in list(bpy.data.objects):
+            if ob.users == 0:
+                bpy.data.objects.remove(ob)
+        for collection in (bpy.data.meshes, bpy.data.materials, bpy.data.textures, bpy.data.images):
+            for block in list(collection):
+                if block.users == 0:
+                    collection.remove(block)
+
+    def needsRecycle(self):
+        if self.jobCount >= self.maxJobs:
+            return True
+        if residentMemory() > self.maxMemory:
+            # drop the shared caches first; recycle only if that is not enough
+            self.cache.clear()
+            self.resetScene()
+            return residentMemory() > self.maxMemory
+        return False
+
+    def runJob(self, job):
+        if not isinstance(job, dict):
+            return {"id": None, "ok": False, "error": "invalid job: expected a JSON object"}
+        command = job.get("command", "import")
+        result = {"id": job.get("id"), "ok": True}
+        if command == "ping":
+            return result
+        if command == "quit":
+            result["recycle"] = True
+            return result
+
+        timings = {}
+        start = time.perf_counter()
+        try:
+            self.resetScene()
+            timings["reset"] = time.perf_counter() - start
+
+            settings = job.get("settings", {})
+            config = ImportSettings(
+                        CoordinateSystem=settings.get("CoordinateSystem", 1),
+                        UpwardAxis=settings.get("UpwardAxis", 1),
+                        SplitNormals=settings.get("SplitNormals", False),
+                        TrackChanges=settings.get("TrackChanges", False)
+                     )
+            t = time.perf_counter()
+            if command not in ("import", "convert"):
+                raise RuntimeError("unknown command: " + str(command))
+            # the import functions only print on a bad path, so check it here
+            fileName = os.path.expanduser(job.get("filepath", ""))
+            if os.path.splitext(fileName)[1].lower() != ".x":
+                raise RuntimeError("not a x file: " + fileName)
+            if not os.path.isfile(fileName):
+                raise RuntimeError("no such file: " + fileName)
+            if job.get("blocks") is not None:
+                importXFileBlocks(job["filepath"], config, job["blocks"], self.cache)
+            else:
+                importXFile(job["filepath"], config, self.cache)
+            timings["import"] = time.perf_counter() - t
+
+            if command == "convert":
+                t = time.perf_counter()
+                output = os.path.expanduser(job["output"])
+                if output.lower().endswith(".x"):
+                    exportXFile(output, ExportSettings(
+                        CoordinateSystem=settings.get("CoordinateSystem", 1),
+                        UpwardAxis=settings.get("UpwardAxis", 1),
+                        Format=settings.get("Format", "TXT")))
+                else:
+                    bpy.ops.wm.save_as_mainfile(filepath=output, copy=True)
+                timings["output"] = time.perf_counter() - t
+
+            result["objects"] = [ob.name for ob in bpy.context.scene.objects]
+        except Exception as e:
+            result["ok"] = False
+            result["error"] = str(e)
+            result["traceback"] = traceback.format_exc()
+        timings["total"] = time.perf_counter() - start
+        result["timings"] = timings
+
+        self.jobCount += 1
+        result["recycle"] = self.needsRecycle()
+        result["memory"] = residentMemory()
+        return result
+
+    def serveStream(self, inp, out):
+        """Answer jobs read from inp on out. Returns True when the worker should stop.
+
+        stopRequested is set before the reply is written, so a client that
+        disconnects early cannot cancel a recycle."""
+        for line in inp:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                job = json.loads(line)
+            except ValueError as e:
+                result = {"id": None, "ok": False, "error": "invalid job: " + str(e)}
+            else:
+                # one bad line must not take the worker down
+                try:
+                    result = self.runJob(job)
+                except Exception as e:
+                    result = {"id": None, "ok": False, "error": str(e),
+                              "traceback": traceback.format_exc()}
+            if result.get("recycle"):
+                self.stopRequested = True
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+            if self.stopRequested:
+                return True
+        return False
+
+    def serveStdin(self):
+        # keep the protocol on the original stdout and send everything else,
+        # including Blender's own messages, to stderr
+        sys.stdout.flush()
+        out = os.fdopen(os.dup(1), "w")
+        os.dup2(2, 1)
+        try:
+            inp = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8", errors="replace")
+            self.serveStream(inp, out)
+        finally:
+            out.close()
+
+    def serveSocket(self, socketPath):
+        if os.path.lexists(socketPath):
+            if not stat.S_ISSOCK(os.lstat(socketPath).st_mode):
+                raise RuntimeError(socketPath + " exists and is not a socket")
+            os.remove(socketPath)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(socketPath)
+        server.listen(1)
+        try:
+            while not self.stopRequested:
+                conn, _ = server.accept()
+                inp = conn.makefile("r", encoding="utf-8", errors="replace")
+                out = conn.makefile("w")
+                try:
+                    self.serveStream(inp, out)
+                except (BrokenPipeError, ConnectionResetError):
+                    print("Client disconnected before its reply was sent")
+                finally:
+                    for f in (inp, out):
+                        try:
+                            f.close()
+                        except OSError:
+                            pass
+                    conn.close()
+        finally:
+            server.close()
+            os.remove(socketPath)
+
+def workerMain(argv):
+    """Entry point of the worker, e.g.
+
+        blender --background --python __init__.py -- --worker --socket /tmp/x.sock
+    """
+    import argparse
+    ap = argparse.ArgumentParser(prog="directx_x worker")
+    ap.add_argument("--worker", action="store_true")
+    ap.add_argument("--socket", default=None, help="Unix socket path; stdin/stdout when omitted")
+    ap.add_argument("--max-jobs", type=int, default=200)
+    ap.add_argument("--max-memory", type=float, default=4096, help="MB")
+    args = ap.parse_args(argv)
+    worker = ImportWorker(maxJobs=args.max_jobs, maxMemory=args.max_memory)
+    if args.socket:
+        worker.serveSocket(args.socket)
+    else:
+        worker.serveStdin()
 
 if __name__ == "__main__":
     register()
+    if "--" in sys.argv and "--worker" in sys.argv[sys.argv.index("--") + 1:]:
+        workerMain(sys.argv[sys.argv.index("--") + 1:])
@@ -0,0 +1,50 @@
+# Round-trip export benchmark: imports a synthetic file, exports it as text
+# and binary .x, reports export throughput in MB/s and re-imports the text
+# output to check that the face count survives the round trip.
+#
+#   blender --background --factory-startup --python benchmarks/bench_export.py -- --cubes 20000
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import benchutil
+
+import bpy
+
+def main():
+    ap = benchutil.argumentParser("DirectX export benchmark")
+    ap.add_argument("--cubes", type=int, default=20000)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = benchutil.scriptArgs(ap)
+
+    x = benchutil.loadAddon()
+    worker = x.ImportWorker()
+    directory = tempfile.mkdtemp()
+    source = os.path.join(directory, "cubes.x")
+    benchutil.writeCubesFile(source, args.cubes)
+
+    worker.resetScene()
+    x.importXFile(source, x.ImportSettings())
+    vertices, faces = benchutil.sceneStats(bpy)
+    print("scene: %d vertices, %d faces" % (vertices, faces))
+
+    print("%-8s %10s %10s %10s" % ("format", "size MB", "time s", "MB/s"))
+    for fmt in ("TXT", "BIN"):
+        output = os.path.join(directory, "out_" + fmt.lower() + ".x")
+        best = None
+        for r in range(args.repeat):
+            with benchutil.Timer() as t:
+                x.exportXFile(output, x.ExportSettings(Format=fmt))
+            best = t.elapsed if best is None else min(best, t.elapsed)
+        size = os.path.getsize(output) / 1e6
+        print("%-8s %10.2f %10.3f %10.1f" % (fmt, size, best, size / best))
+
+    worker.resetScene()
+    x.importXFile(os.path.join(directory, "out_txt.x"), x.ImportSettings())
+    roundTrip = benchutil.sceneStats(bpy)
+    print("round trip: %d vertices, %d faces (%s)" % (roundTrip[0], roundTrip[1],
+          "ok" if roundTrip[1] == faces else "FACE COUNT MISMATCH"))
+
+main()
@@ -0,0 +1,48 @@
+# Times importing frame hierarchies that are deep (one long chain) and wide
+# (many siblings under one root), with and without a mesh in every frame.
+#
+#   blender --background --factory-startup --python benchmarks/bench_frames.py -- --deep 3000 --wide 5000
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import benchutil
+
+import bpy
+
+def main():
+    ap = benchutil.argumentParser("Frame hierarchy import benchmark")
+    ap.add_argument("--deep", type=int, default=3000)
+    ap.add_argument("--wide", type=int, default=5000)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = benchutil.scriptArgs(ap)
+
+    x = benchutil.loadAddon()
+    worker = x.ImportWorker()
+    directory = tempfile.mkdtemp()
+    cases = []
+    for withMeshes in (False, True):
+        suffix = "meshes" if withMeshes else "empties"
+        deep = os.path.join(directory, "deep_%s.x" % suffix)
+        benchutil.writeFramesFile(deep, args.deep, 1, withMeshes)
+        cases.append(("deep %d %s" % (args.deep, suffix), deep))
+        wide = os.path.join(directory, "wide_%s.x" % suffix)
+        benchutil.writeFramesFile(wide, 1, args.wide, withMeshes)
+        cases.append(("wide %d %s" % (args.wide, suffix), wide))
+
+    print("%-24s %10s %10s %10s %12s" % ("case", "objects", "vertices", "time s", "objects/s"))
+    for label, path in cases:
+        best = None
+        for r in range(args.repeat):
+            worker.resetScene()
+            with benchutil.Timer() as t:
+                x.importXFile(path, x.ImportSettings())
+            if best is None or t.elapsed < best:
+                best = t.elapsed
+        objects = len(bpy.context.scene.objects)
+        vertices, faces = benchutil.sceneStats(bpy)
+        print("%-24s %10d %10d %10.3f %12.0f" % (label, objects, vertices, best, objects / best))
+
+main()
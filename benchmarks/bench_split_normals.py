@@ -0,0 +1,46 @@
+# Compares the vertex-splitting MeshNormals path with custom split normals:
+# resulting vertex count, resident memory growth, import time and whether the
+# imported corner normals still match the hard-surface MeshNormals.
+#
+#   blender --background --factory-startup --python benchmarks/bench_split_normals.py -- --cubes 20000
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import benchutil
+
+import bpy
+
+def main():
+    ap = benchutil.argumentParser("MeshNormals import benchmark")
+    ap.add_argument("--cubes", type=int, default=20000)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = benchutil.scriptArgs(ap)
+
+    x = benchutil.loadAddon()
+    worker = x.ImportWorker()
+    path = os.path.join(tempfile.mkdtemp(), "cubes.x")
+    benchutil.writeCubesFile(path, args.cubes)
+    print("file: %s (%.1f MB, %d cubes)" % (path, os.path.getsize(path) / 1e6, args.cubes))
+
+    print("%-20s %10s %10s %12s %10s %12s" % ("mode", "vertices", "faces", "memory MB", "time s", "normal err"))
+    for splitNormals in (False, True):
+        best = None
+        for r in range(args.repeat):
+            worker.resetScene()
+            before = x.residentMemory()
+            with benchutil.Timer() as t:
+                x.importXFile(path, x.ImportSettings(SplitNormals=splitNormals))
+            grown = x.residentMemory() - before
+            if best is None or t.elapsed < best[0]:
+                best = (t.elapsed, grown)
+        vertices, faces = benchutil.sceneStats(bpy)
+        error = benchutil.hardNormalError(bpy)
+        mode = "custom normals" if splitNormals else "split vertices"
+        print("%-20s %10d %10d %12.1f %10.3f %12.5f" % (mode, vertices, faces, best[1], best[0], error))
+        if error > 1e-3:
+            print("  corner normals differ from MeshNormals")
+
+main()
@@ -0,0 +1,111 @@
+# Shared helpers for the benchmark scripts in this directory.
+#
+# The scripts run inside Blender, e.g.
+#   blender --background --factory-startup --python benchmarks/bench_split_normals.py -- --cubes 20000
+
+import os
+import sys
+import time
+import argparse
+import importlib.util
+
+import numpy
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def loadAddon():
+    spec = importlib.util.spec_from_file_location(
+        "io_import_directx_x", os.path.join(ROOT, "__init__.py"),
+        submodule_search_locations=[ROOT])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+def scriptArgs(parser):
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    return parser.parse_args(argv)
+
+def argumentParser(description):
+    return argparse.ArgumentParser(description=description)
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.elapsed = time.perf_counter() - self.start
+
+def writeCubesFile(path, nCubes):
+    """Hard-surface test file: nCubes separate cubes in one Mesh, each with
+    its 8 corners shared by 6 faces that carry their own MeshNormals."""
+    side = max(1, int(round(nCubes ** (1.0 / 3.0))))
+    corners = [(0,0,0),(1,0,0),(1,1,0),(0,1,0),(0,0,1),(1,0,1),(1,1,1),(0,1,1)]
+    quads = [(0,3,2,1),(4,5,6,7),(0,1,5,4),(1,2,6,5),(2,3,7,6),(3,0,4,7)]
+    normals = [(0,0,-1),(0,0,1),(0,-1,0),(1,0,0),(0,1,0),(-1,0,0)]
+    coords = []
+    faces = []
+    faceNormals = []
+    for c in range(nCubes):
+        ox, oy, oz = 2 * (c % side), 2 * ((c // side) % side), 2 * (c // (side * side))
+        base = len(coords)
+        coords.extend([(x + ox, y + oy, z + oz) for x, y, z in corners])
+        faces.extend([tuple(base + i for i in q) for q in quads])
+        faceNormals.extend([(n, n, n, n) for n in range(6)])
+    with open(path, "w") as fp:
+        fp.write("xof 0303txt 0032\nMesh Cubes {\n")
+        writeVectors(fp, coords)
+        writeFaces(fp, faces)
+        fp.write("MeshNormals {\n")
+        writeVectors(fp, normals)
+        writeFaces(fp, faceNormals)
+        fp.write("}\n}\n")
+
+def writeVectors(fp, vectors):
+    fp.write("%d;\n" % len(vectors))
+    fp.write(",\n".join("%f;%f;%f;" % v for v in vectors) + ";\n")
+
+def writeFaces(fp, faces):
+    fp.write("%d;\n" % len(faces))
+    fp.write(",\n".join("%d;%s;" % (len(f), ",".join(map(str, f))) for f in faces) + ";\n")
+
+def sceneStats(bpy):
+    meshes = [ob.data for ob in bpy.context.scene.objects if ob.type == 'MESH']
+    return (sum(len(me.vertices) for me in meshes), sum(len(me.polygons) for me in meshes))
+
+def writeFramesFile(path, depth, width, withMeshes=True):
+    """Frame hierarchy test file: width chains of depth nested frames under
+    one root, each frame optionally holding a one-triangle Mesh."""
+    with open(path, "w") as fp:
+        fp.write("xof 0303txt 0032\nFrame Root {\n")
+        for w in range(width):
+            for d in range(depth):
+                fp.write("Frame F%d_%d {\n" % (w, d))
+                fp.write("FrameTransformMatrix { 1,0,0,0,0,1,0,0,0,0,1,0,0,0,1,1;; }\n")
+                if withMeshes:
+                    fp.write("Mesh { 3; 0;0;0;, 1;0;0;, 0;1;0;; 1; 3;0,1,2;; }\n")
+            fp.write("}\n" * depth)
+        fp.write("}\n")
+
+def hardNormalError(bpy):
+    """Largest distance between a corner normal and its face normal. Every
+    corner of writeCubesFile carries its face's normal, so an import that
+    honours MeshNormals gives (close to) zero."""
+    worst = 0.0
+    for ob in bpy.context.scene.objects:
+        if ob.type != 'MESH':
+            continue
+        me = ob.data
+        me.calc_normals_split()
+        loopNormals = numpy.empty(len(me.loops) * 3, dtype=numpy.float32)
+        me.loops.foreach_get("normal", loopNormals)
+        me.free_normals_split()
+        faceNormals = numpy.empty(len(me.polygons) * 3, dtype=numpy.float32)
+        me.polygons.foreach_get("normal", faceNormals)
+        loopTotal = numpy.empty(len(me.polygons), dtype=numpy.int32)
+        me.polygons.foreach_get("loop_total", loopTotal)
+        expected = numpy.repeat(faceNormals.reshape(-1, 3), loopTotal, axis=0)
+        if len(expected):
+            worst = max(worst, float(numpy.abs(loopNormals.reshape(-1, 3) - expected).max()))
+    return worst